@@ -2,13 +2,22 @@
 # Ethan Greenhouse 
 # 5/16/2024
 
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, stream_template
 from spotipy.oauth2 import SpotifyOAuth
+from spotipy.cache_handler import CacheFileHandler, MemoryCacheHandler
+from requests.adapters import HTTPAdapter
+from cachetools import TTLCache
 import spotipy
+import orjson
 import random
 import os
-from collections import defaultdict
-from typing import Dict, List
+import re
+import threading
+import operator
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
 app = Flask(__name__, template_folder='templates')
 
@@ -16,59 +25,182 @@ SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
 SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
 SPOTIFY_REDIRECT_URI = "http://localhost:8888/callback"
 
+# Listed by genre-seeds but rejected by the recommendations endpoint
+UNRELIABLE_GENRE_SEEDS = frozenset({'hip-hop', 'trip-hop'})
+
+# Only leaf API calls may be submitted here; a task that waits on this pool can deadlock it
+SPOTIFY_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='spotify')
+
+_PL_RE = re.compile(
+    r'(?:open\.spotify\.com/(?:[^/?#]+/)*playlist/|spotify:playlist:)'
+    r'([A-Za-z0-9]{22})(?![A-Za-z0-9])'
+)
+
+_PL_URI_PREFIX = 'spotify:playlist:'
+
+def _is_playlist_id(value: str) -> bool:
+    return len(value) == 22 and value.isascii() and value.isalnum()
+
+def extract_playlist_id(playlist_input: str) -> str:
+    stripped = playlist_input.strip()
+
+    if _is_playlist_id(stripped):
+        return stripped
+    if stripped.startswith(_PL_URI_PREFIX) and _is_playlist_id(stripped[len(_PL_URI_PREFIX):]):
+        return stripped[len(_PL_URI_PREFIX):]
+
+    m = _PL_RE.search(stripped)
+    if m:
+        return m.group(1)
+    raise ValueError("Invalid Spotify playlist URL or ID")
+
+def _orjson_response(response, *args, **kwargs):
+    response.json = lambda **kw: orjson.loads(response.content)
+    return response
+
+class WriteThroughCacheHandler(MemoryCacheHandler):
+    def __init__(self, cache_path: Optional[str] = None):
+        self._file_handler = CacheFileHandler(cache_path=cache_path)
+        super().__init__(token_info=self._file_handler.get_cached_token())
+
+    def save_token_to_cache(self, token_info):
+        super().save_token_to_cache(token_info)
+        self._file_handler.save_token_to_cache(token_info)
+
+class RateLimitedSpotify(spotipy.Spotify):
+    MAX_IN_FLIGHT = 30
+    _IN_FLIGHT = threading.Semaphore(MAX_IN_FLIGHT)
+    MAX_RATE_LIMIT_RETRIES = 4
+    BACKOFF_BASE = 0.5
+    BACKOFF_CAP = 30.0
+
+    def __init__(self, *args, **kwargs):
+        # Keep 429 out of urllib3's retries so Retry-After reaches _internal_call
+        kwargs.setdefault('status_forcelist', (500, 502, 503, 504))
+        super().__init__(*args, **kwargs)
+        self._session.hooks['response'].append(_orjson_response)
+
+    def _build_session(self):
+        super()._build_session()
+        # Replacing the adapter drops spotipy's Retry policy unless it is carried over
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=self.MAX_IN_FLIGHT,
+            max_retries=self._session.get_adapter('https://').max_retries
+        )
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def _internal_call(self, method, url, payload, params):
+        for attempt in range(self.MAX_RATE_LIMIT_RETRIES + 1):
+            try:
+                with self._IN_FLIGHT:
+                    return super()._internal_call(method, url, payload, dict(params))
+            except spotipy.SpotifyException as e:
+                # spotipy maps exhausted 5xx retries to a 429 with no headers; don't retry those
+                if e.http_status != 429 or not e.headers or attempt == self.MAX_RATE_LIMIT_RETRIES:
+                    raise
+                try:
+                    delay = float(e.headers.get('Retry-After'))
+                except (TypeError, ValueError):
+                    # Missing, or an HTTP-date rather than a number of seconds
+                    delay = min(self.BACKOFF_CAP, self.BACKOFF_BASE * 2 ** attempt)
+                else:
+                    if delay > self.BACKOFF_CAP:
+                        raise
+
+            time.sleep(delay + random.uniform(0, 0.5))
+
 class SpotifyPlaylistEnhancer:
+    _GENRE_CACHE: Optional[List[str]] = None
+    _GENRE_LOCK = threading.Lock()
+
     def __init__(self, client_id: str, client_secret: str, redirect_uri: str):
         scope = "playlist-modify-public playlist-modify-private playlist-read-collaborative user-library-read"
-        self.sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
+        self.sp = RateLimitedSpotify(auth_manager=SpotifyOAuth(
             client_id=client_id,
             client_secret=client_secret,
             redirect_uri=redirect_uri,
-            scope=scope
+            scope=scope,
+            cache_handler=WriteThroughCacheHandler()
         ))
 
-    def suggest_similar_tracks(self, playlist_id: str, num_suggestions: int = 6, danceability: float = 0.5, energy: float = 0.5, valence: float = 0.5) -> List[Dict]:
+    def _genres(self) -> List[str]:
+        with SpotifyPlaylistEnhancer._GENRE_LOCK:
+            if SpotifyPlaylistEnhancer._GENRE_CACHE is None:
+                SpotifyPlaylistEnhancer._GENRE_CACHE = self.sp.recommendation_genre_seeds()['genres']
+        return SpotifyPlaylistEnhancer._GENRE_CACHE
+
+    def _load_playlist(self, playlist_id: str, fields: str = 'items(track(id,artists(id)),added_by.id),total') -> List[Dict]:
+        def fetch_page(offset: int) -> Dict:
+            return self.sp.playlist_items(
+                playlist_id,
+                fields=fields,
+                limit=100,
+                offset=offset,
+                additional_types=('track', 'episode')
+            )
+
+        first_page = fetch_page(0)
+        items = list(first_page.get('items', []))
+        for page in SPOTIFY_EXECUTOR.map(fetch_page, range(100, first_page.get('total', 0), 100)):
+            items.extend(page.get('items', []))
+
+        return items
+
+    def suggest_similar_tracks(self, playlist_id: str, num_suggestions: int = 6, danceability: float = 0.5, energy: float = 0.5, valence: float = 0.5, items: Optional[List[Dict]] = None) -> List[Dict]:
         try:
-            results = self.sp.playlist_tracks(playlist_id)
-            tracks = results['items']
+            genres_future = SPOTIFY_EXECUTOR.submit(self._genres)
+
+            tracks = items if items is not None else self._load_playlist(playlist_id)
 
             if not tracks:
                 raise ValueError("Playlist is empty")
 
-            valid_tracks = [track['track'] for track in tracks if track['track'] and track['track']['id']]
+            # Episodes have no artists to seed with
+            valid_tracks = [track['track'] for track in tracks if track.get('track') and track['track'].get('id') and track['track'].get('artists')]
 
             if not valid_tracks:
                 raise ValueError("No valid tracks found in playlist")
 
-            track_ids = [track['id'] for track in valid_tracks]
-            audio_features = [f for f in self.sp.audio_features(track_ids) if f]
+            track_ids = list(dict.fromkeys(track['id'] for track in valid_tracks))
+            track_id_set = set(track_ids)
+
+            # Only checked for emptiness, so one 100-id page (the endpoint maximum) is enough
+            audio_features = [f for f in (self.sp.audio_features(track_ids[:100]) or []) if f]
 
             if not audio_features:
                 raise ValueError("Could not analyze audio features")
 
-            avg_features = {
-                'danceability': sum(f['danceability'] for f in audio_features) / len(audio_features),
-                'energy': sum(f['energy'] for f in audio_features) / len(audio_features),
-                'valence': sum(f['valence'] for f in audio_features) / len(audio_features)
-            }
-
             seed_tracks = random.sample(track_ids, min(2, len(track_ids)))
-            artists = list(set(track['artists'][0]['id'] for track in valid_tracks))
-            seed_artists = random.sample(artists, min(2, len(artists)))
+            idxs = random.sample(range(len(valid_tracks)), min(2, len(valid_tracks)))
+            seed_artists = list({valid_tracks[i]['artists'][0]['id'] for i in idxs})
 
-            available_genres = self.sp.recommendation_genre_seeds()['genres']
-            seed_genre = [random.choice(available_genres)]
+            seed_genre = []
+            available_genres = [g for g in genres_future.result() if g not in UNRELIABLE_GENRE_SEEDS]
+            if available_genres:
+                seed_genre = [random.choice(available_genres)]
 
-            recommendations = self.sp.recommendations(
+            recommendation_args = dict(
                 seed_tracks=seed_tracks,
                 seed_artists=seed_artists,
-                seed_genres=seed_genre,
                 target_danceability=danceability,
                 target_energy=energy,
                 target_valence=valence,
-                limit=num_suggestions
+                limit=min(100, max(num_suggestions * 2, num_suggestions + 10))
             )
 
-            new_tracks = [track for track in recommendations['tracks'] if track['id'] not in track_ids]
+            try:
+                recommendations = self.sp.recommendations(seed_genres=seed_genre, **recommendation_args)
+            except spotipy.SpotifyException as e:
+                # e.msg starts with the request url, which always contains seed_genres=
+                spotify_message = (e.msg or '').split(':\n', 1)[-1]
+                rejected_genre = 'genre' in f"{e.reason or ''} {spotify_message}".lower()
+                if not (seed_genre and e.http_status == 400 and rejected_genre):
+                    raise
+                recommendations = self.sp.recommendations(**recommendation_args)
+
+            new_tracks = [track for track in recommendations['tracks'] if track['id'] not in track_id_set]
 
             return new_tracks[:num_suggestions]
 
@@ -76,26 +208,24 @@ class SpotifyPlaylistEnhancer:
             print(f"Error in suggest_similar_tracks: {str(e)}")
             raise
 
-    def analyze_contributor_balance(self, playlist_id: str) -> Dict[str, int]:
-        contributor_counts = defaultdict(int)
-        offset = 0
-        limit = 100
+    def analyze_contributor_balance(self, playlist_id: str, items: Optional[List[Dict]] = None) -> Dict[str, int]:
+        contributor_counts = Counter()
 
-        while True:
-            response = self.sp.playlist_tracks(playlist_id, offset=offset, limit=limit)
-            tracks = response.get('items', [])
+        if items is None:
+            items = self._load_playlist(playlist_id, fields='items(added_by.id),total')
 
-            if not tracks:
-                break
+        contributor_counts.update(track['added_by']['id'] for track in items if track.get('added_by') and track['added_by'].get('id'))
 
-            for track in tracks:
-                added_by = track['added_by']
-                if added_by and added_by.get('id'):
-                    contributor_counts[added_by['id']] += 1
+        return dict(contributor_counts)
 
-            offset += limit
+ENHANCER = SpotifyPlaylistEnhancer(
+    client_id=SPOTIFY_CLIENT_ID,
+    client_secret=SPOTIFY_CLIENT_SECRET,
+    redirect_uri=SPOTIFY_REDIRECT_URI
+)
 
-        return dict(contributor_counts)
+RESULT_CACHE = TTLCache(maxsize=256, ttl=300)
+RESULT_CACHE_LOCK = threading.Lock()
 
 @app.route('/')
 def index():
@@ -104,45 +234,57 @@ def index():
 @app.route('/result', methods=['POST'])
 def result():
     playlist_input = request.form['spotify_url']
-    playlist_id = playlist_input.strip()
 
     num_recommendations = int(request.form['num_recommendations'])
-    danceability = float(request.form['danceability'])
-    energy = float(request.form['energy'])
-    valence = float(request.form['valence'])
+    danceability = round(float(request.form['danceability']), 2)
+    energy = round(float(request.form['energy']), 2)
+    valence = round(float(request.form['valence']), 2)
 
-    enhancer = SpotifyPlaylistEnhancer(
-        client_id=SPOTIFY_CLIENT_ID,
-        client_secret=SPOTIFY_CLIENT_SECRET,
-        redirect_uri=SPOTIFY_REDIRECT_URI
-    )
+    enhancer = ENHANCER
 
     try:
-        tracks = enhancer.suggest_similar_tracks(
-            playlist_id,
-            num_suggestions=num_recommendations,
-            danceability=danceability,
-            energy=energy,
-            valence=valence
-        )
+        playlist_id = extract_playlist_id(playlist_input)
+        cache_key = (playlist_id, num_recommendations, danceability, energy, valence)
+
+        with RESULT_CACHE_LOCK:
+            cached = RESULT_CACHE.get(cache_key)
+
+        if cached is not None:
+            tracks, contributor_balance = cached
+        else:
+            items = enhancer._load_playlist(playlist_id)
+
+            tracks = enhancer.suggest_similar_tracks(
+                playlist_id,
+                num_suggestions=num_recommendations,
+                danceability=danceability,
+                energy=energy,
+                valence=valence,
+                items=items
+            )
 
-        contributor_balance = enhancer.analyze_contributor_balance(playlist_id)
+            contributor_balance = enhancer.analyze_contributor_balance(playlist_id, items=items)
+
+            with RESULT_CACHE_LOCK:
+                RESULT_CACHE[cache_key] = (tracks, contributor_balance)
 
         # Format tracks with artists as a list of dictionaries (name and id)
-        formatted_tracks = []
-        for track in tracks:
-            artist_info = [{'name': artist['name'], 'id': artist['id']} for artist in track['artists']]  # Extract artist name and ID
-            formatted_tracks.append({
-                'name': track['name'],
-                'artists': artist_info,  # Pass artist data as a list of dicts
-                'id': track['id']
-            })
+        get_track_fields = operator.itemgetter('name', 'artists', 'id')
+        get_artist_fields = operator.itemgetter('name', 'id')
+        formatted_tracks = [
+            {
+                'name': name,
+                'artists': [{'name': a_name, 'id': a_id} for a_name, a_id in map(get_artist_fields, artists)],  # Pass artist data as a list of dicts
+                'id': track_id
+            }
+            for name, artists, track_id in map(get_track_fields, tracks)
+        ]
 
-        return render_template('result.html', tracks=formatted_tracks, contributor_balance=contributor_balance)
+        return stream_template('result.html', tracks=formatted_tracks, contributor_balance=contributor_balance)
 
     except Exception as e:
         error_message = f"Error: {str(e)}"
-        return render_template('result.html', error=error_message)
+        return stream_template('result.html', error=error_message)
 
-if __name__ == '__main__':
+if __name__ == '__main__' and os.getenv('FLASK_DEV'):
     app.run(debug=True)
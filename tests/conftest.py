@@ -0,0 +1,5 @@
+import os
+
+# app builds its Spotify client at import time, which needs credentials to be set
+os.environ.setdefault('SPOTIFY_CLIENT_ID', 'test-client-id')
+os.environ.setdefault('SPOTIFY_CLIENT_SECRET', 'test-client-secret')
@@ -0,0 +1,34 @@
+import pytest
+
+from app import extract_playlist_id
+
+PLAYLIST_ID = '37i9dQZF1DXcBWIGoYBM5M'
+
+
+@pytest.mark.parametrize('playlist_input', [
+    f'https://open.spotify.com/playlist/{PLAYLIST_ID}',
+    f'https://open.spotify.com/playlist/{PLAYLIST_ID}?si=0123abcd',
+    f'https://open.spotify.com/intl-de/playlist/{PLAYLIST_ID}',
+    f'https://open.spotify.com/user/spotify/playlist/{PLAYLIST_ID}?si=a',
+    f'https://open.spotify.com/embed/playlist/{PLAYLIST_ID}',
+    f'spotify:playlist:{PLAYLIST_ID}',
+    PLAYLIST_ID,
+    f'  {PLAYLIST_ID}\n',
+])
+def test_extract_playlist_id_accepts_playlist_forms(playlist_input):
+    assert extract_playlist_id(playlist_input) == PLAYLIST_ID
+
+
+@pytest.mark.parametrize('playlist_input', [
+    'https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC',
+    'https://open.spotify.com/album/4aawyAB9vmqN3uQ7FjRGTy',
+    'spotify:track:4uLU6hMCjMI75M1A2tKUQC',
+    PLAYLIST_ID + 'X',
+    f'https://open.spotify.com/playlist/{PLAYLIST_ID}X',
+    f'spotify:playlist:{PLAYLIST_ID}X',
+    'not a playlist',
+    '',
+])
+def test_extract_playlist_id_rejects_other_input(playlist_input):
+    with pytest.raises(ValueError):
+        extract_playlist_id(playlist_input)
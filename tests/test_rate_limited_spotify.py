@@ -0,0 +1,104 @@
+import pytest
+import requests
+import spotipy
+from urllib3.exceptions import MaxRetryError
+
+import app
+from app import RateLimitedSpotify
+
+
+def make_response(status, headers=None, body=b'{"ok": true}'):
+    response = requests.Response()
+    response.status_code = status
+    response.url = 'https://api.spotify.com/v1/me'
+    response.headers['Content-Type'] = 'application/json'
+    response.headers.update(headers or {})
+    response._content = body
+    return response
+
+
+@pytest.fixture
+def client():
+    return RateLimitedSpotify(auth='test-token')
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app.time, 'sleep', calls.append)
+    monkeypatch.setattr(app.random, 'uniform', lambda a, b: 0)
+    return calls
+
+
+def fake_requests(client, monkeypatch, *responses):
+    sent = []
+    queue = list(responses)
+
+    def request(method, url, **kwargs):
+        sent.append(url)
+        response = queue.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(client._session, 'request', request)
+    return sent
+
+
+def test_retry_after_is_honoured(client, sleeps, monkeypatch):
+    sent = fake_requests(client, monkeypatch, make_response(429, {'Retry-After': '2'}), make_response(200))
+
+    assert client._get('me') == {'ok': True}
+    assert len(sent) == 2
+    assert sleeps == [2.0]
+
+
+def test_missing_retry_after_backs_off_exponentially_then_gives_up(client, sleeps, monkeypatch):
+    attempts = RateLimitedSpotify.MAX_RATE_LIMIT_RETRIES + 1
+    sent = fake_requests(client, monkeypatch, *[make_response(429) for _ in range(attempts)])
+
+    with pytest.raises(spotipy.SpotifyException) as excinfo:
+        client._get('me')
+
+    assert excinfo.value.http_status == 429
+    assert len(sent) == attempts
+    assert sleeps == [RateLimitedSpotify.BACKOFF_BASE * 2 ** i for i in range(attempts - 1)]
+
+
+def test_http_date_retry_after_falls_back_to_backoff(client, sleeps, monkeypatch):
+    fake_requests(
+        client, monkeypatch,
+        make_response(429, {'Retry-After': 'Wed, 21 Oct 2026 07:28:00 GMT'}),
+        make_response(200)
+    )
+
+    assert client._get('me') == {'ok': True}
+    assert sleeps == [RateLimitedSpotify.BACKOFF_BASE]
+
+
+def test_retry_after_above_cap_raises_immediately(client, sleeps, monkeypatch):
+    retry_after = str(int(RateLimitedSpotify.BACKOFF_CAP) + 1)
+    sent = fake_requests(client, monkeypatch, make_response(429, {'Retry-After': retry_after}))
+
+    with pytest.raises(spotipy.SpotifyException) as excinfo:
+        client._get('me')
+
+    assert excinfo.value.http_status == 429
+    assert len(sent) == 1
+    assert sleeps == []
+
+
+def test_exhausted_5xx_retries_are_not_retried_again(client, sleeps, monkeypatch):
+    url = 'https://api.spotify.com/v1/me'
+    retry_error = requests.exceptions.RetryError(
+        MaxRetryError(None, url, 'too many 500 error responses'),
+        request=requests.Request('GET', url).prepare()
+    )
+    sent = fake_requests(client, monkeypatch, retry_error)
+
+    with pytest.raises(spotipy.SpotifyException) as excinfo:
+        client._get('me')
+
+    assert excinfo.value.http_status == 429
+    assert len(sent) == 1
+    assert sleeps == []
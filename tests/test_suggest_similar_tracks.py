@@ -0,0 +1,55 @@
+import pytest
+import spotipy
+
+from app import SpotifyPlaylistEnhancer
+
+RECOMMENDATIONS_URL = 'https://api.spotify.com/v1/recommendations?seed_genres=rock&limit=16'
+
+ITEMS = [
+    {'track': {'id': f'track{i:017d}', 'artists': [{'id': f'artist{i}'}]}, 'added_by': {'id': 'user'}}
+    for i in range(3)
+]
+
+
+class FakeSpotify:
+    def __init__(self, first_error=None):
+        self.first_error = first_error
+        self.recommendation_calls = []
+
+    def recommendation_genre_seeds(self):
+        return {'genres': ['rock']}
+
+    def audio_features(self, tracks):
+        return [{'danceability': 0.5, 'energy': 0.5, 'valence': 0.5} for _ in tracks]
+
+    def recommendations(self, **kwargs):
+        self.recommendation_calls.append(kwargs)
+        if self.first_error and len(self.recommendation_calls) == 1:
+            raise spotipy.SpotifyException(400, -1, f'{RECOMMENDATIONS_URL}:\n {self.first_error}')
+        return {'tracks': [{'id': 'new-track', 'name': 'New', 'artists': []}]}
+
+
+@pytest.fixture
+def enhancer(monkeypatch):
+    monkeypatch.setattr(SpotifyPlaylistEnhancer, '_GENRE_CACHE', None)
+    return SpotifyPlaylistEnhancer('test-client-id', 'test-client-secret', 'http://localhost:8888/callback')
+
+
+def test_rejected_genre_seed_retries_once_without_genre(enhancer):
+    enhancer.sp = FakeSpotify(first_error='invalid genre seed')
+
+    tracks = enhancer.suggest_similar_tracks('playlist', items=ITEMS)
+
+    assert [t['id'] for t in tracks] == ['new-track']
+    assert len(enhancer.sp.recommendation_calls) == 2
+    assert enhancer.sp.recommendation_calls[0]['seed_genres'] == ['rock']
+    assert 'seed_genres' not in enhancer.sp.recommendation_calls[1]
+
+
+def test_other_bad_request_is_not_retried(enhancer):
+    enhancer.sp = FakeSpotify(first_error='invalid request')
+
+    with pytest.raises(spotipy.SpotifyException):
+        enhancer.suggest_similar_tracks('playlist', items=ITEMS)
+
+    assert len(enhancer.sp.recommendation_calls) == 1
@@ -0,0 +1,6 @@
+# Genify: Playlist Enhancer
+# WSGI entry point for gunicorn (see Procfile)
+
+from app import app
+
+__all__ = ['app']